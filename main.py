@@ -1,36 +1,81 @@
 # main.py
-from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Query, File, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, Query, File, UploadFile, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, ForeignKey, Boolean, Index, insert, inspect, text, select, bindparam
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.dialects.sqlite import DATETIME
+from sqlalchemy.orm import sessionmaker, relationship, Session, selectinload
+from sqlalchemy.pool import QueuePool
 import uvicorn
 from typing import List, Optional
 import os
-import shutil
+import re
+import tempfile
 from datetime import datetime
 from starlette.middleware.sessions import SessionMiddleware
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+import secrets
+import hashlib
+from PIL import Image
 
 # 建立資料夾
 os.makedirs("templates", exist_ok=True)
 os.makedirs("static", exist_ok=True)
 os.makedirs("static/images", exist_ok=True)
+os.makedirs(".jinja_cache", exist_ok=True)
 
 # 初始化 FastAPI
 app = FastAPI(title="餐廳點餐管理系統")
 app.add_middleware(SessionMiddleware, secret_key="some-random-secret-key")
 security = HTTPBasic()
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# 快取編譯後的模板，重新啟動後不必再次解析
+templates.env.bytecode_cache = FileSystemBytecodeCache(directory=".jinja_cache")
+# 日期僅在顯示時格式化，例如 {{ order.order_date | datetime }}
+templates.env.filters["datetime"] = lambda value, fmt="%Y-%m-%d %H:%M:%S": value.strftime(fmt) if value else ""
+
+# 上傳圖片檔名不重複、寫入後不再變動，可讓瀏覽器長期快取
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, full_path, *args, **kwargs):
+        response = super().file_response(full_path, *args, **kwargs)
+        if os.path.dirname(os.path.abspath(full_path)) == os.path.abspath("static/images"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 
 # 設定資料庫
 SQLALCHEMY_DATABASE_URL = "sqlite:///./restaurant.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# 使用連線池重複利用連線，PRAGMA 只需在建立連線時執行一次
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=16,
+    max_overflow=32,
+    pool_recycle=3600,
+    pool_pre_ping=True,
+)
+
+# 每條連線建立時設定 SQLite 參數（WAL 模式讓讀取不阻塞寫入）
+@event.listens_for(engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-32000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -53,6 +98,7 @@ class MenuItem(Base):
     price = Column(Float)
     description = Column(String, nullable=True)
     image_path = Column(String, nullable=True)  # 新增圖片路徑欄位
+    thumbnail_path = Column(String, nullable=True)  # 背景產生的縮圖路徑
     
     order_items = relationship("OrderItem", back_populates="menu_item")
 
@@ -61,11 +107,21 @@ class Order(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    order_date = Column(String)
+    # 以秒為單位儲存，格式與既有資料（YYYY-MM-DD HH:MM:SS）一致
+    order_date = Column(
+        DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+        index=True,
+        default=datetime.now,
+    )
     total_price = Column(Float)
     
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
+    
+    # 訂單歷史依使用者篩選並依日期排序
+    __table_args__ = (
+        Index("ix_orders_user_date", "user_id", order_date.desc()),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -83,10 +139,29 @@ class MenuSetting(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     full_menu_image = Column(String, nullable=True)  # 儲存總菜單圖片路徑
+    menu_version = Column(Integer, default=0)  # 菜單異動時遞增，用於判斷快取是否過期
 
 # 建立資料表
 Base.metadata.create_all(bind=engine)
 
+# 既有資料庫不會自動補建索引，在此補上
+for index in Order.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+# 既有資料庫補上菜單版本欄位
+if "menu_version" not in {column["name"] for column in inspect(engine).get_columns("menu_settings")}:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE menu_settings ADD COLUMN menu_version INTEGER DEFAULT 0"))
+
+# 既有資料庫補上縮圖路徑欄位
+if "thumbnail_path" not in {column["name"] for column in inspect(engine).get_columns("menu_items")}:
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE menu_items ADD COLUMN thumbnail_path VARCHAR"))
+
+# 常用查詢預先建立，重複使用 SQLAlchemy 的編譯快取
+SELECT_USER_BY_ID = select(User).where(User.id == bindparam("id"))
+SELECT_MENU_ITEM_BY_ID = select(MenuItem).where(MenuItem.id == bindparam("id"))
+
 # 資料庫相依注入
 def get_db():
     db = SessionLocal()
@@ -95,6 +170,44 @@ def get_db():
     finally:
         db.close()
 
+# 密碼雜湊（共用同一個 hasher）；雜湊運算耗時，路由中需以 run_in_threadpool 呼叫
+password_hasher = PasswordHasher()
+# 帳號不存在時用來比對的固定雜湊，讓回應時間與帳號存在時一致
+DUMMY_PASSWORD_HASH = password_hasher.hash(secrets.token_hex(16))
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+def verify_dummy_password(password: str):
+    try:
+        password_hasher.verify(DUMMY_PASSWORD_HASH, password)
+    except VerificationError:
+        pass
+
+def verify_password(user: Optional[User], password: str, db: Session) -> bool:
+    if user is None or user.password is None:
+        verify_dummy_password(password)
+        return False
+    
+    # 舊資料以明文儲存（一般已由 init_db 轉換），同樣執行一次雜湊運算以維持回應時間一致
+    if not user.password.startswith("$argon2"):
+        verify_dummy_password(password)
+        if not secrets.compare_digest(user.password.encode(), password.encode()):
+            return False
+        user.password = hash_password(password)
+        db.commit()
+        return True
+    
+    try:
+        password_hasher.verify(user.password, password)
+    except (VerificationError, InvalidHashError):
+        return False
+    
+    if password_hasher.check_needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.commit()
+    return True
+
 # 初始化資料庫
 def init_db():
     db = SessionLocal()
@@ -103,11 +216,11 @@ def init_db():
     restaurant = db.query(User).filter(User.is_restaurant == True).first()
     if not restaurant:
         # 創建餐廳管理員帳號
-        restaurant_user = User(username="restaurant", password="restaurant", is_restaurant=True)
+        restaurant_user = User(username="restaurant", password=hash_password("restaurant"), is_restaurant=True)
         db.add(restaurant_user)
         
         # 創建一般用戶帳號
-        customer = User(username="customer", password="customer", is_restaurant=False)
+        customer = User(username="customer", password=hash_password("customer"), is_restaurant=False)
         db.add(customer)
         
         # 預設菜單項目
@@ -125,6 +238,13 @@ def init_db():
         
         db.commit()
     
+    # 將舊有的明文密碼轉為雜湊值
+    legacy_users = db.query(User).filter(User.password.is_not(None), User.password.not_like("$argon2%")).all()
+    for user in legacy_users:
+        user.password = hash_password(user.password)
+    if legacy_users:
+        db.commit()
+    
     db.close()
 
 # 獲取當前使用者
@@ -133,7 +253,23 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     if not auth:
         return None
     
-    user = db.query(User).filter(User.id == auth["user_id"]).first()
+    # 同一個請求內只查詢一次
+    if hasattr(request.state, "user"):
+        return request.state.user
+    
+    user = db.execute(SELECT_USER_BY_ID, {"id": auth["user_id"]}).scalar_one_or_none()
+    request.state.user = user
+    return user
+
+# 權限檢查：未登入或權限不足時導回登入頁
+def require_user(user: Optional[User] = Depends(get_current_user)) -> User:
+    if not user:
+        raise HTTPException(status_code=303, headers={"Location": "/"})
+    return user
+
+def require_restaurant(user: Optional[User] = Depends(get_current_user)) -> User:
+    if not user or not user.is_restaurant:
+        raise HTTPException(status_code=303, headers={"Location": "/"})
     return user
 
 # 獲取菜單設定
@@ -146,22 +282,172 @@ def get_menu_settings(db: Session = Depends(get_db)):
         db.refresh(menu_setting)
     return menu_setting
 
-# 儲存上傳的圖片
-def save_image(upload_file: UploadFile) -> str:
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S%f")
-    filename = f"{timestamp}.jpg"
+# 菜單快取：以 menu_settings.menu_version 判斷是否需要重新載入（多個 worker 亦適用）
+# 同時保存顧客端版本（有縮圖時 image_path 改用縮圖）
+menu_cache = (None, [], [])
+
+def get_menu_items(db: Session, menu_settings: MenuSetting, thumbnails: bool = False) -> list:
+    global menu_cache
+    version, items, thumbnail_items = menu_cache
+    if version != menu_settings.menu_version:
+        items = [
+            {
+                "id": item.id,
+                "name": item.name,
+                "price": item.price,
+                "description": item.description,
+                "image_path": item.image_path,
+                "thumbnail_path": item.thumbnail_path,
+            }
+            for item in db.query(MenuItem).all()
+        ]
+        thumbnail_items = [
+            {**item, "image_path": item["thumbnail_path"] or item["image_path"]}
+            for item in items
+        ]
+        menu_cache = (menu_settings.menu_version, items, thumbnail_items)
+    return thumbnail_items if thumbnails else items
+
+# 菜單異動時遞增版本（需在同一交易內 commit）
+def bump_menu_version(db: Session):
+    db.query(MenuSetting).update(
+        {MenuSetting.menu_version: MenuSetting.menu_version + 1},
+        synchronize_session=False,
+    )
+
+# 儲存上傳的圖片（分段讀取，寫檔交由執行緒池處理，避免阻塞事件迴圈）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+# 表單其他欄位與 multipart 邊界的額外空間
+MAX_UPLOAD_REQUEST_SIZE = MAX_IMAGE_SIZE + 64 * 1024
+
+# 表單在進入路由前就會被完整接收，因此在讀取內容前依 Content-Length 先行拒絕
+# 使用純 ASGI middleware，其他請求直接轉交，不增加額外負擔
+class UploadSizeLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and scope["path"].startswith("/restaurant/menu/")
+        ):
+            content_length = dict(scope["headers"]).get(b"content-length", b"")
+            if content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_SIZE:
+                response = JSONResponse({"detail": "圖片大小不可超過 5MB"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# 依檔頭判斷圖片格式
+def guess_image_extension(header: bytes) -> Optional[str]:
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+async def save_image(upload_file: UploadFile) -> str:
+    if upload_file.size is not None and upload_file.size > MAX_IMAGE_SIZE:
+        raise HTTPException(status_code=413, detail="圖片大小不可超過 5MB")
+    
+    chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+    extension = guess_image_extension(chunk)
+    if not extension:
+        raise HTTPException(status_code=415, detail="僅支援 JPEG、PNG、GIF、WebP 圖片")
+    
+    filename = f"{secrets.token_hex(12)}.{extension}"
     file_path = f"static/images/{filename}"
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
+    # 先寫入暫存檔，完成後再改名，避免提供寫到一半的檔案
+    fd, temp_path = tempfile.mkstemp(dir="static/images", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            # 未提供大小（例如分塊傳輸）時，於寫入過程中計算
+            size = 0
+            while chunk:
+                size += len(chunk)
+                if size > MAX_IMAGE_SIZE:
+                    raise HTTPException(status_code=413, detail="圖片大小不可超過 5MB")
+                await run_in_threadpool(buffer.write, chunk)
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
     
     return f"/{file_path}"
 
-# 路由
+# 產生縮圖（於背景任務執行，不佔用請求時間）
+THUMBNAIL_SIZE = (800, 800)
 
-@app.on_event("startup")
-async def startup_event():
-    init_db()
+def get_thumbnail_path(image_path: str) -> str:
+    return f"{os.path.splitext(image_path)[0]}.thumb.webp"
+
+def make_thumbnail(item_id: int, image_path: str):
+    source_path = image_path.lstrip("/")
+    thumbnail_path = get_thumbnail_path(source_path)
+    # 先寫入暫存檔再改名，避免頁面連結到寫到一半的縮圖
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(source_path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer, Image.open(source_path) as img:
+            img.thumbnail(THUMBNAIL_SIZE)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            img.save(buffer, "WEBP", quality=80, method=4)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, thumbnail_path)
+    except (OSError, Image.DecompressionBombError, ValueError):
+        # 無法辨識或尺寸過大的圖片維持使用原檔
+        return
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    # 記錄縮圖路徑並遞增菜單版本，讓快取重新載入
+    db = SessionLocal()
+    try:
+        item = db.execute(SELECT_MENU_ITEM_BY_ID, {"id": item_id}).scalar_one_or_none()
+        if item and item.image_path == image_path:
+            item.thumbnail_path = f"/{thumbnail_path}"
+            bump_menu_version(db)
+            db.commit()
+    finally:
+        db.close()
+
+# 模板檔案版本（啟動時計算一次），模板更新後 ETag 隨之改變
+TEMPLATES_VERSION = hashlib.md5(
+    repr(sorted((name, os.path.getmtime(f"templates/{name}")) for name in os.listdir("templates"))).encode(),
+    usedforsecurity=False,
+).hexdigest()
+
+# 菜單頁面的 ETag 由頁面、使用者與菜單版本組成，不需查詢菜單或渲染模板即可比對
+def menu_etag(page: str, user: User, menu_settings: MenuSetting) -> str:
+    key = f"{page}:{user.id}:{menu_settings.menu_version}:{menu_settings.full_menu_image}:{TEMPLATES_VERSION}"
+    return f'"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"'
+
+# If-None-Match 可能包含多個 ETag 或弱比對（W/）的 ETag
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+# 路由
+# 預設資料由 __main__ 在啟動 worker 前建立一次，請以 python main.py 啟動服務
 
 # 主頁
 @app.get("/", response_class=HTMLResponse)
@@ -185,12 +471,12 @@ async def login(
     
     # 如果用戶不存在且是學生登入，創建新用戶
     if not user and not is_restaurant:
-        user = User(username=username, password=password, is_restaurant=False)
+        user = User(username=username, password=await run_in_threadpool(hash_password, password), is_restaurant=False)
         db.add(user)
         db.commit()
         db.refresh(user)
     # 如果用戶不存在且是管理員登入，或密碼不正確
-    elif not user or user.password != password:
+    elif not await run_in_threadpool(verify_password, user, password, db):
         return templates.TemplateResponse("login.html", {
             "request": request, 
             "error": "帳號或密碼不正確"
@@ -214,12 +500,17 @@ async def logout(request: Request):
 
 # 餐廳管理 - 訂單管理
 @app.get("/restaurant/dashboard", response_class=HTMLResponse)
-async def restaurant_dashboard(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    orders = db.query(Order).order_by(Order.order_date.desc()).all()
+async def restaurant_dashboard(request: Request, user: User = Depends(require_restaurant), db: Session = Depends(get_db)):
+    # 預先載入下單者與訂單項目，避免模板中逐筆延遲載入
+    orders = (
+        db.query(Order)
+        .options(
+            selectinload(Order.user),
+            selectinload(Order.items).selectinload(OrderItem.menu_item),
+        )
+        .order_by(Order.order_date.desc())
+        .all()
+    )
     return templates.TemplateResponse("restaurant_dashboard.html", {
         "request": request, 
         "user": user,
@@ -228,11 +519,7 @@ async def restaurant_dashboard(request: Request, db: Session = Depends(get_db)):
 
 # 餐廳管理 - 使用者管理
 @app.get("/restaurant/users", response_class=HTMLResponse)
-async def restaurant_users(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
+async def restaurant_users(request: Request, user: User = Depends(require_restaurant), db: Session = Depends(get_db)):
     all_users = db.query(User).all()
     return templates.TemplateResponse("restaurant_users.html", {
         "request": request, 
@@ -247,14 +534,11 @@ async def add_user(
     username: str = Form(...), 
     password: str = Form(...),
     is_restaurant: str = Form(...),
+    user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
     is_restaurant_bool = is_restaurant.lower() == "true"
-    new_user = User(username=username, password=password, is_restaurant=is_restaurant_bool)
+    new_user = User(username=username, password=await run_in_threadpool(hash_password, password), is_restaurant=is_restaurant_bool)
     db.add(new_user)
     db.commit()
     
@@ -267,30 +551,23 @@ async def update_user(
     user_id: int,
     password: str = Form(...),
     confirm_password: str = Form(...),
+    current_user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    current_user = get_current_user(request, db)
-    if not current_user or not current_user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-
     if password != confirm_password:
         return RedirectResponse(url="/restaurant/users", status_code=303)
 
-    target_user = db.query(User).filter(User.id == user_id).first()
+    target_user = db.execute(SELECT_USER_BY_ID, {"id": user_id}).scalar_one_or_none()
     if target_user:
-        target_user.password = password
+        target_user.password = await run_in_threadpool(hash_password, password)
         db.commit()
 
     return RedirectResponse(url="/restaurant/users", status_code=303)
 
 # 餐廳管理 - 刪除使用者
 @app.get("/restaurant/users/delete/{user_id}", response_class=HTMLResponse)
-async def delete_user(request: Request, user_id: int, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(request: Request, user_id: int, user: User = Depends(require_restaurant), db: Session = Depends(get_db)):
+    db_user = db.execute(SELECT_USER_BY_ID, {"id": user_id}).scalar_one_or_none()
     if db_user:
         db.delete(db_user)
         db.commit()
@@ -299,44 +576,46 @@ async def delete_user(request: Request, user_id: int, db: Session = Depends(get_
 
 # 餐廳管理 - 菜單管理
 @app.get("/restaurant/menu", response_class=HTMLResponse)
-async def restaurant_menu(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    menu_items = db.query(MenuItem).all()
+async def restaurant_menu(request: Request, user: User = Depends(require_restaurant), db: Session = Depends(get_db)):
     menu_settings = get_menu_settings(db)
+    etag = menu_etag("restaurant_menu", user, menu_settings)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    
+    menu_items = get_menu_items(db, menu_settings)
     
     return templates.TemplateResponse("restaurant_menu.html", {
         "request": request, 
         "user": user,
         "menu_items": menu_items,
         "full_menu_image": menu_settings.full_menu_image
-    })
+    }, headers=etag_headers(etag))
 
 # 餐廳管理 - 新增菜單項目
 @app.post("/restaurant/menu/add", response_class=HTMLResponse)
 async def add_menu_item(
     request: Request, 
+    background_tasks: BackgroundTasks,
     name: str = Form(...), 
     price: float = Form(...), 
     description: str = Form(...),
     item_image: Optional[UploadFile] = File(None),
+    user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
     # 處理圖片上傳
     image_path = None
     if item_image and item_image.filename:
-        image_path = save_image(item_image)
+        image_path = await save_image(item_image)
     
     new_item = MenuItem(name=name, price=price, description=description, image_path=image_path)
     db.add(new_item)
+    bump_menu_version(db)
     db.commit()
     
+    if image_path:
+        background_tasks.add_task(make_thumbnail, new_item.id, image_path)
+    
     return RedirectResponse(url="/restaurant/menu", status_code=303)
 
 # 餐廳管理 - 更新菜單項目
@@ -347,17 +626,15 @@ async def update_menu_item(
     name: str = Form(...), 
     price: float = Form(...), 
     description: str = Form(...), 
+    user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
+    item = db.execute(SELECT_MENU_ITEM_BY_ID, {"id": item_id}).scalar_one_or_none()
     if item:
         item.name = name
         item.price = price
         item.description = description
+        bump_menu_version(db)
         db.commit()
     
     return RedirectResponse(url="/restaurant/menu", status_code=303)
@@ -366,21 +643,22 @@ async def update_menu_item(
 @app.post("/restaurant/menu/upload-image/{item_id}", response_class=HTMLResponse)
 async def upload_menu_item_image(
     request: Request,
+    background_tasks: BackgroundTasks,
     item_id: int,
     item_image: UploadFile = File(...),
+    user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
+    item = db.execute(SELECT_MENU_ITEM_BY_ID, {"id": item_id}).scalar_one_or_none()
     if item and item_image.filename:
         # 保存新圖片
-        image_path = save_image(item_image)
+        image_path = await save_image(item_image)
+        background_tasks.add_task(make_thumbnail, item_id, image_path)
         
-        # 更新菜單項目
+        # 更新菜單項目（舊縮圖不再適用）
         item.image_path = image_path
+        item.thumbnail_path = None
+        bump_menu_version(db)
         db.commit()
     
     return RedirectResponse(url="/restaurant/menu", status_code=303)
@@ -390,17 +668,14 @@ async def upload_menu_item_image(
 async def upload_full_menu_image(
     request: Request,
     full_menu_image: UploadFile = File(...),
+    user: User = Depends(require_restaurant),
     db: Session = Depends(get_db)
 ):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
     menu_settings = get_menu_settings(db)
     
     if full_menu_image.filename:
         # 保存新圖片
-        image_path = save_image(full_menu_image)
+        image_path = await save_image(full_menu_image)
         
         # 更新菜單設定
         menu_settings.full_menu_image = image_path
@@ -410,74 +685,74 @@ async def upload_full_menu_image(
 
 # 餐廳管理 - 刪除菜單項目
 @app.get("/restaurant/menu/delete/{item_id}", response_class=HTMLResponse)
-async def delete_menu_item(request: Request, item_id: int, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user or not user.is_restaurant:
-        return RedirectResponse(url="/", status_code=303)
-    
-    item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
+async def delete_menu_item(request: Request, item_id: int, user: User = Depends(require_restaurant), db: Session = Depends(get_db)):
+    item = db.execute(SELECT_MENU_ITEM_BY_ID, {"id": item_id}).scalar_one_or_none()
     if item:
         db.delete(item)
+        bump_menu_version(db)
         db.commit()
     
     return RedirectResponse(url="/restaurant/menu", status_code=303)
 
 # 使用者 - 菜單瀏覽
 @app.get("/customer/menu", response_class=HTMLResponse)
-async def customer_menu(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return RedirectResponse(url="/", status_code=303)
-    
-    menu_items = db.query(MenuItem).all()
+async def customer_menu(request: Request, user: User = Depends(require_user), db: Session = Depends(get_db)):
     menu_settings = get_menu_settings(db)
+    etag = menu_etag("customer_menu", user, menu_settings)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    
+    # 顧客端顯示縮圖以減少傳輸量
+    menu_items = get_menu_items(db, menu_settings, thumbnails=True)
     
     return templates.TemplateResponse("customer_menu.html", {
         "request": request, 
         "user": user,
         "menu_items": menu_items,
         "full_menu_image": menu_settings.full_menu_image
-    })
+    }, headers=etag_headers(etag))
 
 # 使用者 - 下單
+QUANTITY_FIELD_RE = re.compile(r"^quantity_(\d+)$")
+
 @app.post("/customer/order", response_class=HTMLResponse)
-async def place_order(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return RedirectResponse(url="/", status_code=303)
-    
+async def place_order(request: Request, user: User = Depends(require_user), db: Session = Depends(get_db)):
     form_data = await request.form()
-    order_items = []
-    total_price = 0
     
+    # 先收集所有欲訂購的品項與數量
+    wanted = {}
     for key, value in form_data.items():
-        if key.startswith("quantity_") and int(value) > 0:
-            item_id = int(key.split("_")[1])
-            quantity = int(value)
-            
-            menu_item = db.query(MenuItem).filter(MenuItem.id == item_id).first()
-            if menu_item:
-                order_items.append({"item": menu_item, "quantity": quantity})
-                total_price += menu_item.price * quantity
+        match = QUANTITY_FIELD_RE.match(key)
+        if not match:
+            continue
+        quantity = int(value)
+        if quantity > 0:
+            wanted[int(match.group(1))] = quantity
+    
+    # 一次查詢所有菜單項目
+    menu_items = {}
+    if wanted:
+        menu_items = {
+            menu_item.id: menu_item
+            for menu_item in db.query(MenuItem).filter(MenuItem.id.in_(wanted)).all()
+        }
+    order_items = [(item_id, quantity) for item_id, quantity in wanted.items() if item_id in menu_items]
+    total_price = sum(menu_items[item_id].price * quantity for item_id, quantity in order_items)
     
     if order_items:
         # 創建訂單
         order = Order(
             user_id=user.id,
-            order_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             total_price=total_price
         )
         db.add(order)
         db.flush()
         
-        # 添加訂單項目
-        for item in order_items:
-            order_item = OrderItem(
-                order_id=order.id,
-                menu_item_id=item["item"].id,
-                quantity=item["quantity"]
-            )
-            db.add(order_item)
+        # 添加訂單項目（單一批次寫入）
+        db.execute(insert(OrderItem), [
+            {"order_id": order.id, "menu_item_id": item_id, "quantity": quantity}
+            for item_id, quantity in order_items
+        ])
         
         db.commit()
         
@@ -487,18 +762,21 @@ async def place_order(request: Request, db: Session = Depends(get_db)):
 
 # 使用者 - 訂單歷史
 @app.get("/customer/orders", response_class=HTMLResponse)
-async def customer_orders(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    if not user:
-        return RedirectResponse(url="/", status_code=303)
-    
-    orders = db.query(Order).filter(Order.user_id == user.id).order_by(Order.order_date.desc()).all()
+async def customer_orders(request: Request, user: User = Depends(require_user), db: Session = Depends(get_db)):
+    # 一次預先載入訂單項目與對應菜單，避免逐筆查詢
+    orders = (
+        db.query(Order)
+        .options(selectinload(Order.items).selectinload(OrderItem.menu_item))
+        .filter(Order.user_id == user.id)
+        .order_by(Order.order_date.desc())
+        .all()
+    )
     
     # 獲取訂單項目
     for order in orders:
         order.items_with_details = []
         for item in order.items:
-            menu_item = db.query(MenuItem).filter(MenuItem.id == item.menu_item_id).first()
+            menu_item = item.menu_item
             order.items_with_details.append({
                 "name": menu_item.name,
                 "price": menu_item.price,
@@ -520,4 +798,7 @@ if __name__ == "__main__":
     print("預設之顧客 - username: customer, password: customer")
     print("管理員、顧客 - 輸入帳號及密碼登入")
     print("請訪問 http://localhost:8000 開始使用！")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # 先在主程序初始化資料，避免多個 worker 同時寫入預設資料
+    init_db()
+    # 多個 worker 使用所有 CPU；已安裝 uvloop/httptools 時會自動採用
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=os.cpu_count(), loop="auto", http="auto")
\ No newline at end of file